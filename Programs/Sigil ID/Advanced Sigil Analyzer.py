@@ -1,18 +1,39 @@
+import os
+# One single-threaded tesseract per core beats one tesseract using OpenMP across all cores.
+# Set before any import can load libgomp (numpy/numba builds, tesserocr's libtesseract): it reads OMP_THREAD_LIMIT once, at load
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, scrolledtext
-from PIL import Image, ImageTk, ImageDraw
+from PIL import Image, ImageTk, ImageDraw, ImageColor
+import numpy as np
 import pymupdf # Fitz
-import pdfplumber
 import pytesseract 
 import imagehash 
+try:
+    import orjson # Optional C JSON codec for writing and loading the scan output
+except ImportError:
+    orjson = None
+try:
+    from numba import njit, prange # Optional JIT for the Hamming-distance kernel
+except ImportError:
+    njit = None
+try:
+    import tesserocr # Optional in-process OCR backend, preferred over the pytesseract subprocess when present
+except ImportError:
+    tesserocr = None
 import re
 import json
-import os
 import threading
 import time
 import asyncio # For LLM calls
 import base64 # For image encoding for LLM
 import io
+import hashlib
+import multiprocessing
+import pickle
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from itertools import repeat
 
 # Attempt to import LLM libraries, but don't make them hard requirements initially
 try:
@@ -29,9 +50,13 @@ except ImportError:
 DEFAULT_PDF_NAME = "Dictionary-of-Occult-Hermetic-Alchemical-Sigils-Symbols-Fred-Gettings-1981.pdf"
 OUTPUT_JSON_PATH = "sigil_dictionary_extracted_with_sigils_metadata.json" 
 OUTPUT_IMAGE_DIR = "extracted_sigil_images" 
+LLM_CACHE_DIR = ".llm_cache" # Responses keyed by SHA-256 of provider, model, prompt and image
+PHASH_CACHE_PATH = os.path.splitext(OUTPUT_JSON_PATH)[0] + "_phash_cache.pkl" # image path -> (mtime, pHash)
 
 DEFAULT_START_PAGE_EXTRACTION = 38 
 DEFAULT_END_PAGE_EXTRACTION = 291 
+SCAN_PREVIEW_INTERVAL_S = 0.25 # Refresh the scan preview at most ~4 times per second
+QUERY_RESULTS_BATCH_SIZE = 50 # Entries rendered per batch in the query results; the rest wait for "Load more"
 
 # --- Drawing Canvas Constants ---
 DRAW_CANVAS_WIDTH = 250
@@ -39,13 +64,19 @@ DRAW_CANVAS_HEIGHT = 250
 DRAW_BG_COLOR = "white"
 DRAW_COLOR = "black"
 DRAW_LINE_WIDTH = 3
+DRAW_BG_LEVEL = ImageColor.getcolor(DRAW_BG_COLOR, "L") # Grayscale values used in the hashing buffer
+DRAW_INK_LEVEL = ImageColor.getcolor(DRAW_COLOR, "L")
 
 # --- Regular Expressions ---
 HEADING_CLASS_RE = re.compile(r"^([A-Z0-9][A-Z0-9\s\-’,]+?)\s+([A-Z][a-z]{1,3}\.)")
+# HEADING_CLASS_RE for every line of a "\n"-joined page at once: \s minus "\n", so no match crosses a line
+HEADING_LINES_RE = re.compile(r"^([A-Z0-9](?:[A-Z0-9\-’,]|[^\S\n])+?)[^\S\n]+([A-Z][a-z]{1,3}\.)", re.MULTILINE)
 BIBLIO_RE = re.compile(r"([A-Z][A-Za-z\s]+?\s\d{4}|[A-Z][A-Za-z\s]+?\s\d{1,2}C)")
 
 POTENTIAL_SYMBOL_RE_OCR = re.compile(r"^[^\s\w.,;:'\"()\[\]?!]{1,5}$") 
-COMMON_PUNCTUATION = ['.', ',', ';', ':', '(', ')', "'", '"', '[', ']', '!', '?','-', '/']
+COMMON_PUNCTUATION = frozenset(['.', ',', ';', ':', '(', ')', "'", '"', '[', ']', '!', '?','-', '/'])
+# One char that is not alphanumeric, whitespace or common punctuation ('_' is \w but not alnum)
+SYMBOL_CHAR_RE = re.compile(r"[^\w\s" + re.escape("".join(sorted(COMMON_PUNCTUATION))) + r"]|_")
 
 
 # --- Overlay Colors ---
@@ -58,8 +89,190 @@ OVERLAY_COLORS = {
     "default": "gray"
 }
 
+# --- LLM Models & Request Limits ---
+LLM_MODEL_NAMES = {"Gemini": "gemini-1.5-flash-latest", "OpenAI": "gpt-4o"}
+LLM_MAX_CONCURRENT_REQUESTS = 8
+LLM_REQUESTS_PER_MINUTE = 60
+LLM_HISTORY_MAX_TURNS = 6 # Earlier question/answer pairs resent with each chat message about a sigil
+
 # --- Tesseract Configuration ---
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe' # Example
+OCR_MAX_WORKERS = os.cpu_count() or 1
+
+# --- Text-Layer Scan Parallelism ---
+SCAN_PROCESS_WORKERS = os.cpu_count() or 1 # Set to 1 to parse pages on the scan thread (easier to debug)
+SCAN_PAGES_PER_TASK = 4
+
+def segment_starts(texts, sep_len=1):
+    """Start offset of each text once they are joined with a separator of length sep_len."""
+    return np.cumsum([0] + [len(t) + sep_len for t in texts[:-1]])
+
+def match_heading_lines(lines):
+    """HEADING_CLASS_RE.match on every line in a single regex pass; per line, (heading, class, match end) or None."""
+    joined = "\n".join(lines)
+    if joined.count("\n") != len(lines) - 1: # A line with its own newline (or no lines); match one by one
+        return [(m.group(1), m.group(2), m.end()) if m else None for m in map(HEADING_CLASS_RE.match, lines)]
+    starts = segment_starts(lines).tolist(); line_at = {start: i for i, start in enumerate(starts)}; found = [None] * len(lines)
+    for m in HEADING_LINES_RE.finditer(joined):
+        i = line_at[m.start()]; found[i] = (m.group(1), m.group(2), m.end() - starts[i])
+    return found
+
+def attach_references(entries):
+    """Fills 'references_raw' of every entry with a single BIBLIO_RE pass over all their descriptions.
+    References keep their order of first appearance."""
+    if not entries: return
+    descriptions = [e["description"] for e in entries]
+    starts, found = segment_starts(descriptions), [[] for _ in entries]
+    entry_of, find_refs = np.searchsorted, BIBLIO_RE.finditer
+    # BIBLIO_RE cannot match \x00, so no match spans two entries
+    for bib_match in find_refs("\x00".join(descriptions)):
+        found[entry_of(starts, bib_match.start(), side='right') - 1].append(bib_match.group(0).strip())
+    for entry, refs in zip(entries, found): entry["references_raw"] = list(dict.fromkeys(refs))
+
+def words_matching(pattern, words):
+    """Boolean mask of the words covered by any match of `pattern` over the space-joined word sequence."""
+    hit = np.zeros(len(words), dtype=bool)
+    if not words: return hit
+    starts = segment_starts(words)
+    for m in pattern.finditer(" ".join(words)):
+        hit[np.searchsorted(starts, m.start(), side='right') - 1 : np.searchsorted(starts, m.end(), side='left')] = True
+    return hit
+
+def stamp_line(canvas_arr, x0, y0, x1, y1, line_width, value):
+    """Rasterizes a round-capped line segment into a 2-D uint8 array in place."""
+    radius = line_width / 2.0
+    height, width = canvas_arr.shape
+    xa, xb = max(int(min(x0, x1) - radius), 0), min(int(max(x0, x1) + radius) + 1, width)
+    ya, yb = max(int(min(y0, y1) - radius), 0), min(int(max(y0, y1) + radius) + 1, height)
+    if xa >= xb or ya >= yb: return
+    ys, xs = np.ogrid[ya:yb, xa:xb]
+    dx, dy = x1 - x0, y1 - y0; seg_len_sq = dx*dx + dy*dy
+    t = np.clip(((xs - x0) * dx + (ys - y0) * dy) / seg_len_sq, 0.0, 1.0) if seg_len_sq else 0.0
+    dist_sq = (xs - (x0 + t * dx))**2 + (ys - (y0 + t * dy))**2
+    canvas_arr[ya:yb, xa:xb][dist_sq <= radius * radius] = value
+
+def popcount_u64(x):
+    """SWAR popcount of a uint64 array, for NumPy < 2.0 which lacks np.bitwise_count."""
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((x * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.uint8)
+
+if njit and not hasattr(np, 'bitwise_count'): # NumPy 2's native popcount is as fast and needs no JIT warm-up
+    _M1, _M2, _M4, _H01 = np.uint64(0x5555555555555555), np.uint64(0x3333333333333333), np.uint64(0x0F0F0F0F0F0F0F0F), np.uint64(0x0101010101010101)
+
+    @njit(parallel=True, cache=True)
+    def _hamming_distances_jit(hashes, query_u64):
+        distances = np.empty(hashes.shape[0], dtype=np.uint8)
+        for i in prange(hashes.shape[0]):
+            x = hashes[i] ^ query_u64
+            x = x - ((x >> np.uint64(1)) & _M1)
+            x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+            x = (x + (x >> np.uint64(4))) & _M4
+            distances[i] = np.uint8((x * _H01) >> np.uint64(56))
+        return distances
+
+def hamming_distances(hashes, query_u64):
+    """Bit distance between each uint64 hash in `hashes` and `query_u64`."""
+    if hasattr(np, 'bitwise_count'): return np.bitwise_count(hashes ^ np.uint64(query_u64))
+    if njit: return _hamming_distances_jit(hashes, np.uint64(query_u64))
+    return popcount_u64(hashes ^ np.uint64(query_u64))
+
+def nearest_indices(distances, k):
+    """Indices of the k smallest distances, closest first and ties in library order (same as a stable
+    full sort), without sorting the whole array."""
+    if len(distances) <= k: return np.argsort(distances, kind='stable')
+    kth = np.partition(distances, k - 1)[k - 1]
+    closer = np.flatnonzero(distances < kth); tied = np.flatnonzero(distances == kth)[:k - len(closer)]
+    candidates = np.concatenate((closer, tied)); candidates.sort() # index order, so the stable argsort keeps library order
+    return candidates[np.argsort(distances[candidates], kind='stable')]
+
+def dump_json_entry(entry):
+    """Serializes one extracted entry as indented UTF-8 JSON bytes."""
+    if orjson: return orjson.dumps(entry, option=orjson.OPT_INDENT_2)
+    return json.dumps(entry, indent=2, ensure_ascii=False).encode('utf-8')
+
+def sigil_thumb_path(img_path):
+    """Where the 60px search-result thumbnail of a sigil image is written."""
+    return os.path.splitext(img_path)[0] + ".thumb60.png"
+
+def render_sigil_crop(fitz_page, clip):
+    """RGBA render of a glyph box at 4x; (size, samples), or None when the clip is empty."""
+    pix = fitz_page.get_pixmap(matrix=pymupdf.Matrix(4.0, 4.0), clip=clip, alpha=True)
+    if pix.width == 0 or pix.height == 0: return None # No need to log, can be common
+    return (pix.width, pix.height), pix.samples
+
+def extract_text_layer_page(fitz_page):
+    """Parses entries, overlays and sigil crops from a page's text layer without touching app state,
+    so it can run in a worker process. Returns (entries, visual_elements, sigil_crops, errors); each crop is
+    [sigil metas sharing it, entry heading, page number, size, RGBA samples] and its metas get their
+    'image_path' once the scan thread names and writes it."""
+    entries_data, visual_elements, current_entry, page_chars, page_text_parts = [], {}, None, [], [] # visual_elements: rect -> first element drawn there
+    sigil_crops, errors = {}, [] # sigil_crops: (rounded clip) -> crop, so a glyph box hit twice is rendered once
+    page_number, page_width, page_height = fitz_page.number + 1, fitz_page.rect.width, fitz_page.rect.height
+    line_texts, line_bboxes = [], []
+    # rawdict gives line bboxes and per-char boxes in one pass; without TEXT_PRESERVE_IMAGES no image bytes are copied out
+    for block in fitz_page.get_text("rawdict", flags=pymupdf.TEXTFLAGS_RAWDICT & ~pymupdf.TEXT_PRESERVE_IMAGES)["blocks"]:
+        for line in block.get("lines", ()):
+            line_chars = [char for span in line["spans"] for char in span["chars"]]
+            page_chars.extend(line_chars)
+            raw_line_text = "".join(char["c"] for char in line_chars); page_text_parts.append(raw_line_text)
+            line_text = raw_line_text.strip()
+            if line_text: line_texts.append(line_text); line_bboxes.append(tuple(line["bbox"]))
+    for line_text, line_bbox, heading_match in zip(line_texts, line_bboxes, match_heading_lines(line_texts)):
+        if heading_match:
+            if current_entry: 
+                current_entry["description"] = " ".join(current_entry["description_parts"]).strip(); del current_entry["description_parts"]
+                entries_data.append(current_entry)
+            heading, category, heading_end = heading_match[0].strip(), heading_match[1].strip(), heading_match[2]
+            current_entry = {"heading": heading, "class": category, "sigils_metadata": [], "description_parts": [], "references_raw": set(), "page_number": page_number}
+            remaining = line_text[heading_end:].strip()
+            if remaining: current_entry["description_parts"].append(remaining)
+            visual_elements.setdefault(line_bbox, {'rect': line_bbox, 'type': 'heading', 'text_snippet': heading})
+        else:
+            visual_elements.setdefault(line_bbox, {'rect': line_bbox, 'type': 'text_block', 'text_snippet': line_text[:30]})
+            if current_entry: current_entry["description_parts"].append(line_text)
+    # rawdict "c" is always a single char, so string offsets index page_chars directly
+    for symbol_match in SYMBOL_CHAR_RE.finditer("".join(page_text_parts)) if current_entry else ():
+        char_info = page_chars[symbol_match.start()]; char_text = char_info['c']
+        x0, y0, x1, y1 = char_info['bbox']
+        padding = 1; padded_bbox = pymupdf.Rect(x0-padding, y0-padding, x1+padding, y1+padding)
+        if padded_bbox.x0<0 or padded_bbox.y0<0 or padded_bbox.x1>page_width or padded_bbox.y1>page_height or padded_bbox.width > page_width/2 or padded_bbox.height > 50: continue
+        crop_key = tuple(round(c, 1) for c in padded_bbox); crop = sigil_crops.get(crop_key)
+        if crop is None:
+            try: rendered = render_sigil_crop(fitz_page, padded_bbox)
+            except Exception as e: errors.append(f"Error saving sigil: {current_entry['heading']}: {e}"); rendered = None
+            if rendered: crop = sigil_crops[crop_key] = [[], current_entry["heading"], page_number, *rendered]
+        element_type_for_visual = "potential_symbol"
+        if crop:
+            sigil_meta = {"image_path": None, "parent_entry_heading": current_entry["heading"], "page_number": page_number, "source_text": char_text, "bounding_box_pdf_coords": (padded_bbox.x0,padded_bbox.y0,padded_bbox.x1,padded_bbox.y1), "extraction_method": "direct"}
+            current_entry["sigils_metadata"].append(sigil_meta); crop[0].append(sigil_meta); element_type_for_visual = "saved_sigil"
+        visual_elements.setdefault((x0, y0, x1, y1), {'rect': (x0, y0, x1, y1), 'type': element_type_for_visual, 'text_snippet': char_text})
+    page_words = fitz_page.get_text("words") # References span several words, so match the page's word stream once
+    for i in np.flatnonzero(words_matching(BIBLIO_RE, [word[4] for word in page_words])):
+        word_rect = tuple(page_words[i][:4]); visual_elements.setdefault(word_rect, {'rect': word_rect, 'type': 'biblio_ref', 'text_snippet': page_words[i][4]})
+    if current_entry: 
+        current_entry["description"] = " ".join(current_entry["description_parts"]).strip(); del current_entry["description_parts"]
+        entries_data.append(current_entry)
+    attach_references(entries_data)
+    return entries_data, list(visual_elements.values()), list(sigil_crops.values()), errors
+
+def extract_text_layer_pages(pdf_path, page_indices):
+    """Process-pool task: opens its own document and parses a run of text-layer pages."""
+    with pymupdf.open(pdf_path) as doc: return [extract_text_layer_page(doc.load_page(i)) for i in page_indices]
+
+class AsyncTokenBucket:
+    """Token-bucket rate limiter for coroutines running on a single event loop."""
+    def __init__(self, rate_per_sec, capacity):
+        self.rate_per_sec, self.capacity = rate_per_sec, capacity
+        self._tokens, self._last_refill = float(capacity), time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate_per_sec); self._last_refill = now
+            if self._tokens >= 1: self._tokens -= 1; return
+            await asyncio.sleep((1 - self._tokens) / self.rate_per_sec)
 
 class PDFScannerApp:
     def __init__(self, root):
@@ -69,18 +282,34 @@ class PDFScannerApp:
 
         self.pdf_folder_path = tk.StringVar()
         self.selected_pdf_path = tk.StringVar()
-        self.all_extracted_data = [] 
+        self._json_out = None # Scan output, written entry by entry while scanning
+        self._last_preview_ts = 0.0
         self.scanned_data_for_query = [] 
         self.current_pdf_document_fitz = None
-        self.current_pdf_document_plumber = None
         self.zoom_x = 2.0 
         self.zoom_y = 2.0
         self.use_ocr_var = tk.BooleanVar(value=False) 
         self.sigil_counter = 0 
+        self._mousewheel_handlers = {} # canvas -> bound <MouseWheel> handler, built once per canvas
+        self._sigil_render_pool = ThreadPoolExecutor(max_workers=4) # PNG encode/write of sigil crops
+        self._page_pool = None # ProcessPoolExecutor of the running text-layer scan, if any
+        self._sigil_cache = {} # (page number, rounded clip) -> image path, reset per scan
+        self._pending_sigil_renders = [] # (image path, future) for the current page's sigil writes
+        self._sigil_phashes = {} # image path -> 64-bit pHash computed when the sigil was written
+        self._hash_array = np.zeros(0, dtype=np.uint64) # pHashes of all loaded sigils, for vectorized search
+        self._hash_meta = [] # (sigil_meta, parent entry) parallel to _hash_array
+        self._phash_cache = self._load_phash_cache() # image path -> (mtime, pHash) for sigils lacking 'phash_u64'
+        self._query_blobs = [] # Lower-cased searchable text per loaded entry, fields joined by \x00
+        self._trigram_index = {} # 3-char substring -> set of entry indices containing it
+        self._pending_query_search = None # root.after id of the debounced search
+        self._query_search_pool = ThreadPoolExecutor(max_workers=1) # Runs query filtering off the Tk thread
+        self._query_generation = 0 # Bumped per search so results of superseded searches are dropped
+        self._query_rows, self._query_rows_shown = [], 0 # Current query results and how many are rendered
+        self._query_link_paths = [] # Image path of each "View" link in the query results, by link number
 
         self.draw_last_x, self.draw_last_y = None, None
-        self.drawn_image_pil = Image.new("RGB", (DRAW_CANVAS_WIDTH, DRAW_CANVAS_HEIGHT), DRAW_BG_COLOR)
-        self.pil_draw_context = ImageDraw.Draw(self.drawn_image_pil)
+        self._draw_arr = np.full((DRAW_CANVAS_HEIGHT, DRAW_CANVAS_WIDTH), DRAW_BG_LEVEL, dtype=np.uint8) # Grayscale copy of the drawing for hashing
+        self._canvas_dirty = False # Set by the first stroke, so the empty-canvas check never scans the buffer
 
         # LLM related attributes
         self.gemini_api_key = tk.StringVar(value=os.getenv("GOOGLE_API_KEY", ""))
@@ -94,9 +323,26 @@ class PDFScannerApp:
         
         self.active_sigil_for_llm_meta = None # Stores metadata of sigil selected for LLM
         self.active_sigil_for_llm_image_path = None # Path to the image of the active sigil
+        self._active_sigil_bytes = None # Raw PNG bytes of the active sigil, read once on selection
+        self._active_sigil_b64 = None # Base64 of the same bytes for data: URLs
+        self._active_sigil_mime = None
+        self._sigil_payload_cache = {} # image path -> (mtime, raw bytes, base64) so re-selecting a sigil skips the read and encode
+        self._llm_context_prefix = "" # Sigil description opening every prompt, built once per selected sigil
+        self._llm_history = [] # (question, answer) turns about the active sigil, newest last
+
+        # One long-lived event loop on a daemon thread serves every LLM call
+        self._llm_loop = asyncio.new_event_loop()
+        threading.Thread(target=self._llm_loop.run_forever, daemon=True).start()
+        self._llm_semaphore = None # Created on the LLM loop on first use
+        self._openai_client = None # (api key, AsyncOpenAI), reused so requests share one keep-alive pool
+        self._gemini_model = None # (api key, GenerativeModel)
+        self._llm_rate_limiter = AsyncTokenBucket(LLM_REQUESTS_PER_MINUTE / 60.0, LLM_MAX_CONCURRENT_REQUESTS)
+        root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         if not os.path.exists(OUTPUT_IMAGE_DIR):
             os.makedirs(OUTPUT_IMAGE_DIR)
+        if not os.path.exists(LLM_CACHE_DIR):
+            os.makedirs(LLM_CACHE_DIR)
 
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(expand=True, fill='both', padx=10, pady=10)
@@ -176,11 +422,16 @@ class PDFScannerApp:
         self.query_search_var = tk.StringVar()
         self.query_search_entry = ttk.Entry(query_controls_frame, textvariable=self.query_search_var, width=40)
         self.query_search_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        self.query_search_entry.bind("<KeyRelease>", self._on_query_change)
         self.query_search_button = ttk.Button(query_controls_frame, text="Search", command=self.perform_query_search)
         self.query_search_button.pack(side=tk.LEFT, padx=5)
         self.query_results_text = scrolledtext.ScrolledText(query_main_frame, wrap=tk.WORD, height=25)
         self.query_results_text.pack(padx=5, pady=5, expand=True, fill=tk.BOTH)
         self.query_results_text.insert(tk.END, "Load scanned data to view and query entries.")
+        self.query_results_text.tag_configure("sigil_link", foreground="blue", underline=1)
+        self.query_results_text.tag_bind("sigil_link", "<Button-1>", self._on_sigil_link_click)
+        self.query_results_text.tag_bind("sigil_link", "<Enter>", lambda e: self.query_results_text.config(cursor="hand2"))
+        self.query_results_text.tag_bind("sigil_link", "<Leave>", lambda e: self.query_results_text.config(cursor=""))
         self.query_results_text.config(state=tk.DISABLED)
 
     def setup_sigil_search_tab(self):
@@ -227,7 +478,9 @@ class PDFScannerApp:
         ttk.Label(self.sigil_search_results_content_frame, text="Matching sigils will appear here.").pack()
 
     def _bind_mousewheel(self, event, canvas):
-        canvas.bind_all("<MouseWheel>", lambda e: self._on_mousewheel(e, canvas))
+        handler = self._mousewheel_handlers.get(canvas)
+        if handler is None: handler = self._mousewheel_handlers[canvas] = lambda e, c=canvas: self._on_mousewheel(e, c)
+        canvas.bind_all("<MouseWheel>", handler)
 
     def _unbind_mousewheel(self, event, canvas):
         canvas.unbind_all("<MouseWheel>")
@@ -368,49 +621,95 @@ class PDFScannerApp:
                 # self.log_message(f"Page index {page_index_fitz + 1} out of bounds.", "ERROR") # Can be noisy
                 if target_label: target_label.config(image=''); target_label.image = None
                 doc.close(); return
-            page = doc.load_page(page_index_fitz)
-            mat = pymupdf.Matrix(self.zoom_x, self.zoom_y)
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            draw = ImageDraw.Draw(img)
-            if visual_elements:
-                for element in visual_elements:
-                    rect_coords, element_type = element['rect'], element['type']
-                    if element_type in OVERLAY_COLORS:
-                        if 'width' in element and 'height' in element : 
-                             x0_img, y0_img, w_img, h_img = rect_coords
-                             final_rect_img = (x0_img, y0_img, x0_img + w_img, y0_img + h_img)
-                        else: 
-                             x0_pdf, y0_pdf, x1_pdf, y1_pdf = rect_coords
-                             final_rect_img = (x0_pdf*self.zoom_x, y0_pdf*self.zoom_y, x1_pdf*self.zoom_x, y1_pdf*self.zoom_y)
-                        color = OVERLAY_COLORS.get(element_type, OVERLAY_COLORS['default'])
-                        draw.rectangle(final_rect_img, outline=color, width=2)
-            
-            if target_label and target_label.winfo_exists():
-                label_width, label_height = target_label.winfo_width(), target_label.winfo_height()
-                if label_width < 20 or label_height < 20 : label_width, label_height = 700, 800 
-                img.thumbnail((label_width - 20, label_height - 20), Image.LANCZOS)
-                photo = ImageTk.PhotoImage(img)
-                target_label.config(image=photo); target_label.image = photo
-                if target_label == self.pdf_image_label: self.page_info_label.config(text=f"Page: {page_index_fitz + 1} / {len(doc)}")
+            img = self._render_preview_image(doc.load_page(page_index_fitz), visual_elements, self._preview_max_size(target_label))
+            self._push_preview_to_label(img, page_index_fitz, len(doc), target_label)
             doc.close()
         except Exception as e: 
             if target_label and target_label.winfo_exists(): target_label.config(image=''); target_label.image = None
 
+    def _preview_max_size(self, target_label):
+        label_width, label_height = target_label.winfo_width(), target_label.winfo_height()
+        if label_width < 20 or label_height < 20 : label_width, label_height = 700, 800 
+        return label_width - 20, label_height - 20
+
+    def _render_preview_image(self, page, visual_elements, max_size):
+        """Rasterizes a fitz page with its overlays into a PIL image fitting max_size.
+        Touches no Tk state, so the scan worker can call it with the page it already holds."""
+        # Render at roughly the label's size; the full OCR zoom would just be thumbnailed away
+        preview_zoom = max(1.0, min(self.zoom_x, max_size[0] / page.rect.width, max_size[1] / page.rect.height))
+        pix = page.get_pixmap(matrix=pymupdf.Matrix(preview_zoom, preview_zoom), alpha=False)
+        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        draw = ImageDraw.Draw(img)
+        if visual_elements:
+            # OCR elements are in pixels of the zoom_x render, the others in PDF points
+            pdf_scale, ocr_scale, colors, rectangle = preview_zoom, preview_zoom / self.zoom_x, OVERLAY_COLORS, draw.rectangle
+            for element in visual_elements:
+                color = colors.get(element['type'])
+                if color is None: continue
+                r = element['rect']
+                if 'width' in element and 'height' in element: final_rect_img = (r[0]*ocr_scale, r[1]*ocr_scale, (r[0] + r[2])*ocr_scale, (r[1] + r[3])*ocr_scale)
+                else: final_rect_img = (r[0]*pdf_scale, r[1]*pdf_scale, r[2]*pdf_scale, r[3]*pdf_scale)
+                rectangle(final_rect_img, outline=color, width=2)
+        img.thumbnail(max_size, Image.LANCZOS)
+        return img
+
+    def _push_preview_to_label(self, img, page_index_fitz, total_pages, target_label=None):
+        """Main-thread half of the preview: only the PhotoImage creation has to happen on the Tk thread."""
+        if target_label is None: target_label = self.pdf_image_label
+        if not (target_label and target_label.winfo_exists()): return
+        photo = ImageTk.PhotoImage(img)
+        target_label.config(image=photo); target_label.image = photo
+        if target_label == self.pdf_image_label: self.page_info_label.config(text=f"Page: {page_index_fitz + 1} / {total_pages}")
 
     def _save_sigil_image(self, fitz_page, sigil_bbox_pdf_points, entry_heading, page_num):
         try:
-            self.sigil_counter += 1
-            clean_heading = re.sub(r'[^\w\-_\. ]', '_', entry_heading[:30])
-            img_filename = f"sigil_{clean_heading}_p{page_num}_id{self.sigil_counter}.png"
-            img_path = os.path.join(OUTPUT_IMAGE_DIR, img_filename)
-            sigil_clip_zoom_matrix = pymupdf.Matrix(4.0, 4.0) 
-            pix = fitz_page.get_pixmap(matrix=sigil_clip_zoom_matrix, clip=sigil_bbox_pdf_points, alpha=True)
-            if pix.width == 0 or pix.height == 0: return None # No need to log, can be common
-            pix.save(img_path)
+            # The same glyph box is often hit more than once on a page; render it only once
+            cache_key = (fitz_page.number, tuple(round(c, 1) for c in sigil_bbox_pdf_points))
+            cached_path = self._sigil_cache.get(cache_key)
+            if cached_path: return cached_path
+            # fitz objects are not thread-safe, so only the PNG encode/write and hashing go to the pool
+            rendered = render_sigil_crop(fitz_page, sigil_bbox_pdf_points)
+            if not rendered: return None
+            img_path = self._queue_sigil_write(entry_heading, page_num, *rendered)
+            self._sigil_cache[cache_key] = img_path
             return img_path
         except Exception as e: self.log_message(f"Error saving sigil: {entry_heading}: {e}", "ERROR"); return None
 
+    def _queue_sigil_write(self, entry_heading, page_num, size, samples):
+        """Names the next sigil image and hands its PNG write and pHash to the render pool."""
+        self.sigil_counter += 1
+        clean_heading = re.sub(r'[^\w\-_\. ]', '_', entry_heading[:30])
+        img_path = os.path.join(OUTPUT_IMAGE_DIR, f"sigil_{clean_heading}_p{page_num}_id{self.sigil_counter}.png")
+        sigil_img = Image.frombytes("RGBa", size, samples).convert("RGBA") # MuPDF alpha pixmaps are premultiplied; pix.save() un-premultiplied too
+        self._pending_sigil_renders.append((img_path, self._sigil_render_pool.submit(self._write_sigil_image, sigil_img, img_path)))
+        return img_path
+
+    def _apply_text_layer_result(self, page_result):
+        """Writes the sigil crops of one extract_text_layer_page result and fills in their paths."""
+        entries_data, visual_elements, sigil_crops, errors = page_result
+        for error in errors: self.log_message(error, "ERROR")
+        for sigil_metas, entry_heading, page_num, size, samples in sigil_crops:
+            img_path = self._queue_sigil_write(entry_heading, page_num, size, samples)
+            for sigil_meta in sigil_metas: sigil_meta["image_path"] = img_path
+        return entries_data, visual_elements
+
+    @staticmethod
+    def _write_sigil_image(sigil_img, img_path):
+        sigil_img.save(img_path)
+        thumb = sigil_img.copy(); thumb.thumbnail((60, 60), Image.BILINEAR); thumb.save(sigil_thumb_path(img_path))
+        return int(str(imagehash.phash(sigil_img)), 16)
+
+    def _wait_for_sigil_renders(self, entries=()):
+        """Waits for pending sigil writes and stores each pHash and thumbnail path on the sigil metadata of `entries`."""
+        for img_path, future in self._pending_sigil_renders:
+            try: self._sigil_phashes[img_path] = future.result()
+            except Exception as e: self.log_message(f"Error writing sigil image {img_path}: {e}", "ERROR")
+        self._pending_sigil_renders = []
+        for entry in entries:
+            for sigil_meta in entry["sigils_metadata"]:
+                phash_u64 = self._sigil_phashes.get(sigil_meta["image_path"])
+                if phash_u64 is not None: sigil_meta["phash_u64"] = phash_u64; sigil_meta["thumb_path"] = sigil_thumb_path(sigil_meta["image_path"])
+
     def start_scan_thread(self):
         pdf_to_scan = self.selected_pdf_path.get()
         if not pdf_to_scan or not os.path.exists(pdf_to_scan): self.log_message("No valid PDF selected.", "ERROR"); return
@@ -418,199 +717,356 @@ class PDFScannerApp:
             self.scan_start_page_idx = int(self.start_page_entry.get()) - 1
             self.scan_end_page_idx = int(self.end_page_entry.get()) - 1
         except ValueError: self.log_message("Invalid page numbers.", "ERROR"); return
+        self._scan_preview_size = self._preview_max_size(self.pdf_image_label) # Read on the Tk thread for the worker
         self.log_message(f"Starting scan: {os.path.basename(pdf_to_scan)} (OCR: {self.use_ocr_var.get()})")
-        self.status_label.config(text="Status: Initializing..."); self.all_extracted_data = []; self.sigil_counter = 0 
+        self.status_label.config(text="Status: Initializing..."); self.sigil_counter = 0; self._sigil_cache = {}; self._sigil_phashes = {}
         scan_thread = threading.Thread(target=self.scan_pdf_worker, args=(pdf_to_scan,)); scan_thread.daemon = True; scan_thread.start()
 
     def scan_pdf_worker(self, pdf_path):
+        tmp_json_path = OUTPUT_JSON_PATH + ".tmp"
         try:
             self.current_pdf_document_fitz = pymupdf.open(pdf_path)
-            if not self.use_ocr_var.get(): self.current_pdf_document_plumber = pdfplumber.open(pdf_path)
             total_pages_in_doc = len(self.current_pdf_document_fitz)
             if not (0 <= self.scan_start_page_idx < total_pages_in_doc): self.log_message("Start page out of bounds.", "ERROR"); self.status_label.config(text="Status: Error"); return
             self.scan_end_page_idx = min(self.scan_end_page_idx, total_pages_in_doc - 1)
             if self.scan_end_page_idx < self.scan_start_page_idx: self.log_message("End page before start.", "ERROR"); self.status_label.config(text="Status: Error"); return
             num_pages_to_scan = self.scan_end_page_idx - self.scan_start_page_idx + 1
-            self.progress_bar["maximum"] = num_pages_to_scan; self.progress_bar["value"] = 0
-            for page_idx_fitz in range(self.scan_start_page_idx, self.scan_end_page_idx + 1):
+            ocr_data_by_page, use_ocr = {}, self.use_ocr_var.get()
+            # With OCR the bar runs once across both phases: OCR fills the first num_pages_to_scan steps, parsing the rest
+            progress_offset = num_pages_to_scan if use_ocr else 0
+            self.root.after(0, lambda: self.progress_bar.configure(maximum=progress_offset + num_pages_to_scan, value=0))
+            page_range = range(self.scan_start_page_idx, self.scan_end_page_idx + 1)
+            # Entries are streamed to a temp file and moved over OUTPUT_JSON_PATH only once the scan finishes
+            entries_written = 0
+            self._json_out = open(tmp_json_path, 'wb'); self._json_out.write(b'[')
+            if use_ocr: ocr_data_by_page = self._run_tesserocr(page_range) if tesserocr else self._run_batched_ocr(page_range)
+            page_tasks = [list(page_range[i:i + SCAN_PAGES_PER_TASK]) for i in range(0, num_pages_to_scan, SCAN_PAGES_PER_TASK)]
+            if not use_ocr and SCAN_PROCESS_WORKERS > 1 and len(page_tasks) > 1:
+                # Text-layer pages parse independently, so worker processes run them on every core; map keeps page order
+                # spawn, not fork: this process already runs the LLM loop and thread pools, whose locks a fork would copy
+                self._page_pool = ProcessPoolExecutor(max_workers=min(SCAN_PROCESS_WORKERS, len(page_tasks)), mp_context=multiprocessing.get_context("spawn"))
+                text_layer_results = (result for task in self._page_pool.map(extract_text_layer_pages, repeat(pdf_path), page_tasks) for result in task)
+            for pages_done, page_idx_fitz in enumerate(page_range, 1):
                 if not self.root: break
                 self.status_label.config(text=f"Status: Analyzing page {page_idx_fitz + 1}...")
-                fitz_page = self.current_pdf_document_fitz.load_page(page_idx_fitz)
-                parsed_entries, visual_elements = [], []
-                if self.use_ocr_var.get(): parsed_entries, visual_elements = self._extract_elements_with_ocr(fitz_page)
+                fitz_page = None
+                if use_ocr:
+                    fitz_page = self.current_pdf_document_fitz.load_page(page_idx_fitz)
+                    parsed_entries, visual_elements = self._extract_elements_with_ocr(ocr_data_by_page.pop(page_idx_fitz, None), fitz_page)
+                elif self._page_pool: parsed_entries, visual_elements = self._apply_text_layer_result(next(text_layer_results))
                 else:
-                    if not self.current_pdf_document_plumber: self.log_message("Plumber doc not open.","ERROR"); break 
-                    plumber_page = self.current_pdf_document_plumber.pages[page_idx_fitz]
-                    parsed_entries, visual_elements = self._extract_elements_from_plumber_page(plumber_page, fitz_page) 
-                self.root.after(0, self.display_page_image_from_path, pdf_path, page_idx_fitz, visual_elements, self.pdf_image_label)
-                for entry in parsed_entries: self.all_extracted_data.append(entry)
-                self.progress_bar["value"] += 1; self.root.update_idletasks(); time.sleep(0.05) 
-            with open(OUTPUT_JSON_PATH, 'w', encoding='utf-8') as f: json.dump(self.all_extracted_data, f, indent=2, ensure_ascii=False)
-            self.log_message(f"Scan complete. Data for {len(self.all_extracted_data)} entries to {OUTPUT_JSON_PATH}")
+                    fitz_page = self.current_pdf_document_fitz.load_page(page_idx_fitz)
+                    parsed_entries, visual_elements = self._apply_text_layer_result(extract_text_layer_page(fitz_page))
+                now = time.monotonic()
+                if now - self._last_preview_ts > SCAN_PREVIEW_INTERVAL_S or page_idx_fitz == self.scan_end_page_idx:
+                    self._last_preview_ts = now
+                    try:
+                        if fitz_page is None: fitz_page = self.current_pdf_document_fitz.load_page(page_idx_fitz)
+                        preview_img = self._render_preview_image(fitz_page, visual_elements, self._scan_preview_size)
+                        self.root.after(0, self._push_preview_to_label, preview_img, page_idx_fitz, total_pages_in_doc, self.pdf_image_label)
+                    except Exception as e: self.log_message(f"Preview error page {page_idx_fitz + 1}: {e}", "WARNING")
+                self._wait_for_sigil_renders(parsed_entries)
+                for entry in parsed_entries:
+                    self._json_out.write((b',\n' if entries_written else b'\n') + dump_json_entry(entry)); entries_written += 1
+                self.root.after(0, lambda v=progress_offset + pages_done: self.progress_bar.configure(value=v))
+            self._json_out.write(b'\n]\n'); self._json_out.close(); self._json_out = None
+            os.replace(tmp_json_path, OUTPUT_JSON_PATH)
+            self.log_message(f"Scan complete. Data for {entries_written} entries to {OUTPUT_JSON_PATH}")
             self.status_label.config(text="Status: Scan Complete!")
         except pytesseract.TesseractNotFoundError: self.log_message("Tesseract not found.", "ERROR"); self.status_label.config(text="Status: Tesseract Error!")
         except Exception as e: self.log_message(f"Scan error: {e}", "ERROR"); self.status_label.config(text="Status: Error")
         finally:
+            if self._page_pool is not None: self._page_pool.shutdown(cancel_futures=True); self._page_pool = None
             if self.current_pdf_document_fitz: self.current_pdf_document_fitz.close()
-            if self.current_pdf_document_plumber: self.current_pdf_document_plumber.close()
-            self.current_pdf_document_fitz = None; self.current_pdf_document_plumber = None
-            self.progress_bar["value"] = 0
+            if self._json_out is not None: self._json_out.close(); self._json_out = None
+            if os.path.exists(tmp_json_path): # Still here only when the scan failed before os.replace
+                try: os.remove(tmp_json_path)
+                except OSError as e: self.log_message(f"Could not remove partial output {tmp_json_path}: {e}", "WARNING")
+            self._wait_for_sigil_renders()
+            self.current_pdf_document_fitz = None
+            self.root.after(0, lambda: self.progress_bar.configure(value=0))
             
-    def _extract_elements_with_ocr(self, fitz_page):
+    def _run_batched_ocr(self, page_indices):
+        """Rasterizes the page range to PNGs and splits it into one image list file per worker,
+        so each tesseract process loads its model once and the batches run on all cores.
+        Returns a dict mapping fitz page index -> that page's OCR DataFrame rows."""
+        mat = pymupdf.Matrix(self.zoom_x, self.zoom_y)
+        ocr_data_by_page = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            image_paths = []
+            for page_idx_fitz in page_indices:
+                self.status_label.config(text=f"Status: Rasterizing page {page_idx_fitz + 1} for OCR...")
+                tmp_png = os.path.join(tmp_dir, f"page_{page_idx_fitz:05d}.png")
+                self.current_pdf_document_fitz.load_page(page_idx_fitz).get_pixmap(matrix=mat, alpha=False).save(tmp_png)
+                image_paths.append(tmp_png)
+            if not image_paths: return ocr_data_by_page
+            num_batches = min(OCR_MAX_WORKERS, len(image_paths)); batch_size = -(-len(image_paths) // num_batches)
+            self.status_label.config(text=f"Status: Running OCR on {len(image_paths)} pages ({num_batches} workers)...")
+            with ThreadPoolExecutor(max_workers=num_batches) as executor:
+                futures = {executor.submit(self._ocr_image_list, tmp_dir, offset, image_paths[offset:offset + batch_size]): offset
+                           for offset in range(0, len(image_paths), batch_size)}
+                pages_done = 0
+                for done_count, future in enumerate(as_completed(futures), 1):
+                    offset = futures[future]; batch_pages = page_indices[offset:offset + batch_size]
+                    pages_done += len(batch_pages)
+                    try: ocr_data = future.result()
+                    except pytesseract.TesseractNotFoundError: raise # No page can be OCR'd; let the scan report it
+                    except Exception as ocr_error: ocr_data = None; self.log_message(f"OCR error pages {batch_pages[0] + 1}-{batch_pages[-1] + 1}: {ocr_error}", "ERROR")
+                    if ocr_data is not None:
+                        ocr_data = ocr_data[ocr_data.conf > -1]
+                        # tesseract numbers pages 1..N in list-file order
+                        for page_num, page_rows in ocr_data.groupby('page_num', sort=False): ocr_data_by_page[page_indices[offset + page_num - 1]] = page_rows
+                    self.status_label.config(text=f"Status: OCR batches done: {done_count}/{len(futures)} ({pages_done}/{len(image_paths)} pages)")
+                    self.root.after(0, lambda v=pages_done: self.progress_bar.configure(value=v))
+        return ocr_data_by_page
+
+    def _ocr_image_list(self, tmp_dir, batch_id, image_paths):
+        list_path = os.path.join(tmp_dir, f"images_{batch_id}.txt")
+        with open(list_path, 'w', encoding='utf-8') as f: f.write("\n".join(image_paths) + "\n")
+        return pytesseract.image_to_data(list_path, output_type=pytesseract.Output.DATAFRAME)
+
+    def _run_tesserocr(self, page_indices):
+        """In-process OCR through tesserocr: each of OCR_MAX_WORKERS threads keeps its own PyTessBaseAPI resident
+        for the whole scan (Recognize releases the GIL) and pages skip the PNG encode + TSV parse round-trip.
+        Pages are rasterized here, since fitz is not thread-safe. Returns the same dict shape as _run_batched_ocr."""
+        mat, ocr_data_by_page, tess_local, tess_apis = pymupdf.Matrix(self.zoom_x, self.zoom_y), {}, threading.local(), []
+        pending, max_in_flight, pages_done = {}, 2 * OCR_MAX_WORKERS, 0 # max_in_flight bounds the rasterized pages held in memory
+        def collect_finished():
+            nonlocal pages_done
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_idx_fitz = pending.pop(future)
+                try: page_rows = future.result()
+                except Exception as ocr_error: self.log_message(f"OCR error page {page_idx_fitz + 1}: {ocr_error}", "ERROR"); continue
+                if page_rows is not None: ocr_data_by_page[page_idx_fitz] = page_rows
+            pages_done += len(done)
+            self.status_label.config(text=f"Status: OCR pages done: {pages_done}/{len(page_indices)}")
+            self.root.after(0, lambda v=pages_done: self.progress_bar.configure(value=v))
+        try:
+            with ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS) as executor:
+                for page_idx_fitz in page_indices:
+                    if len(pending) >= max_in_flight: collect_finished()
+                    pix = self.current_pdf_document_fitz.load_page(page_idx_fitz).get_pixmap(matrix=mat, alpha=False)
+                    page_img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+                    pending[executor.submit(self._tesserocr_page, tess_local, tess_apis, page_img)] = page_idx_fitz
+                while pending: collect_finished()
+        finally:
+            for tess_api in tess_apis: tess_api.End()
+        return ocr_data_by_page
+
+    @staticmethod
+    def _tesserocr_page(tess_local, tess_apis, page_img):
+        """Worker-thread OCR of one page image with that thread's own API; None when nothing was recognized."""
+        tess_api = getattr(tess_local, "api", None)
+        if tess_api is None: tess_api = tess_local.api = tesserocr.PyTessBaseAPI(lang='eng'); tess_apis.append(tess_api)
+        word_level = tesserocr.RIL.WORD
+        tess_api.SetImage(page_img); tess_api.Recognize()
+        ri = tess_api.GetIterator()
+        if ri is None: return None
+        rows, block_num, line_num = [], 0, 0
+        for word in tesserocr.iterate_level(ri, word_level):
+            if word.IsAtBeginningOf(tesserocr.RIL.BLOCK): block_num += 1; line_num = 0
+            if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE): line_num += 1
+            bbox = word.BoundingBox(word_level)
+            if bbox is None: continue
+            x0, y0, x1, y1 = bbox
+            rows.append((block_num, line_num, word.GetUTF8Text(word_level), word.Confidence(word_level), x0, y0, x1 - x0, y1 - y0))
+        return pd.DataFrame(rows, columns=['block_num', 'line_num', 'text', 'conf', 'left', 'top', 'width', 'height']) if rows else None
+
+    def _extract_elements_with_ocr(self, ocr_data, fitz_page):
         entries_data, visual_elements, current_entry = [], [], None
-        mat = pymupdf.Matrix(self.zoom_x, self.zoom_y); pix = fitz_page.get_pixmap(matrix=mat, alpha=False)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        if ocr_data is None: return entries_data, visual_elements
         try:
-            ocr_data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DATAFRAME)
-            ocr_data = ocr_data[ocr_data.conf > -1] 
+            texts = ocr_data['text'].fillna("").astype(str).str.strip()
+            non_blank = texts.astype(bool); ocr_data, texts = ocr_data[non_blank], texts[non_blank]
             lines_for_parsing, current_line_words, last_block_num, last_line_num = [], [], -1, -1
-            for _, row in ocr_data.iterrows():
-                if row['block_num']!=last_block_num or row['line_num']!=last_line_num:
+            for block_num, line_num, text in zip(ocr_data['block_num'], ocr_data['line_num'], texts):
+                if block_num!=last_block_num or line_num!=last_line_num:
                     if current_line_words: lines_for_parsing.append(" ".join(current_line_words))
                     current_line_words = []
-                current_line_words.append(str(row['text']).strip())
-                last_block_num, last_line_num = row['block_num'], row['line_num']
+                current_line_words.append(text)
+                last_block_num, last_line_num = block_num, line_num
             if current_line_words: lines_for_parsing.append(" ".join(current_line_words))
-            for line_text_raw in lines_for_parsing:
-                line_text = line_text_raw.strip(); 
-                if not line_text: continue
-                heading_match = HEADING_CLASS_RE.match(line_text)
+            line_texts = [line_text for line_text in map(str.strip, lines_for_parsing) if line_text]
+            for line_text, heading_match in zip(line_texts, match_heading_lines(line_texts)):
                 if heading_match:
                     if current_entry: 
                         current_entry["description"] = " ".join(current_entry["description_parts"]).strip(); del current_entry["description_parts"]
-                        temp_biblio_set=set(); 
-                        for bib_match in BIBLIO_RE.finditer(current_entry.get("description","")): temp_biblio_set.add(bib_match.group(0).strip())
-                        current_entry["references_raw"]=sorted(list(temp_biblio_set)); entries_data.append(current_entry)
-                    heading, category = heading_match.group(1).strip(), heading_match.group(2).strip()
+                        entries_data.append(current_entry)
+                    heading, category, heading_end = heading_match[0].strip(), heading_match[1].strip(), heading_match[2]
                     current_entry = {"heading": heading, "class": category, "sigils_metadata": [], "description_parts": [], "references_raw": set(), "page_number": fitz_page.number + 1}
-                    remaining = line_text[heading_match.end():].strip(); 
+                    remaining = line_text[heading_end:].strip(); 
                     if remaining: current_entry["description_parts"].append(remaining)
                 elif current_entry: current_entry["description_parts"].append(line_text)
             if current_entry: 
                 current_entry["description"] = " ".join(current_entry["description_parts"]).strip(); del current_entry["description_parts"]
-                temp_biblio_set=set(); 
-                for bib_match in BIBLIO_RE.finditer(current_entry.get("description","")): temp_biblio_set.add(bib_match.group(0).strip())
-                current_entry["references_raw"]=sorted(list(temp_biblio_set)); entries_data.append(current_entry)
-            for i, row in ocr_data.iterrows(): 
-                if pd.isna(row['text']) or str(row['text']).strip() == "": continue
-                x,y,w,h = int(row['left']),int(row['top']),int(row['width']),int(row['height'])
-                text = str(row['text']).strip(); element_type = "text_block"
-                pdf_x0,pdf_y0,pdf_x1,pdf_y1 = x/self.zoom_x, y/self.zoom_y, (x+w)/self.zoom_x, (y+h)/self.zoom_y
-                sigil_bbox_pdf_points_rect = pymupdf.Rect(pdf_x0, pdf_y0, pdf_x1, pdf_y1)
-                is_heading_word = any(text in entry.get('heading','') for entry in entries_data if entry['page_number'] == fitz_page.number + 1)
-                if is_heading_word : element_type = "heading"
-                elif BIBLIO_RE.search(text): element_type = "biblio_ref"
-                elif POTENTIAL_SYMBOL_RE_OCR.match(text):
-                    element_type = "potential_symbol" 
-                    active_entry_for_sigil = next((e for e in reversed(entries_data) if e["page_number"] == fitz_page.number + 1), None)
-                    if active_entry_for_sigil:
-                        img_path = self._save_sigil_image(fitz_page, sigil_bbox_pdf_points_rect, active_entry_for_sigil["heading"], fitz_page.number + 1)
-                        if img_path:
-                            sigil_meta = {"image_path": img_path, "parent_entry_heading": active_entry_for_sigil["heading"], "page_number": fitz_page.number + 1, "source_text": text, "bounding_box_pdf_coords": (pdf_x0,pdf_y0,pdf_x1,pdf_y1), "extraction_method": "ocr"}
-                            active_entry_for_sigil["sigils_metadata"].append(sigil_meta); element_type = "saved_sigil" 
-                visual_elements.append({'rect': (x,y,w,h), 'type': element_type, 'text_snippet': text, 'width': w, 'height': h})
+                entries_data.append(current_entry)
+            attach_references(entries_data)
+            # Classify every word at once; entries_data only holds entries from this page
+            page_headings = tuple(e['heading'] for e in entries_data)
+            page_heading_tokens = frozenset(w for heading in page_headings for w in heading.split())
+            is_heading = texts.isin(page_heading_tokens)
+            if page_headings:
+                # Words that are only part of a heading token (e.g. OCR splits) still count; a word never
+                # contains a newline, so one test against the joined headings equals any(text in heading ...)
+                joined_headings = "\n".join(page_headings)
+                unmatched = ~is_heading
+                is_heading[unmatched] = texts[unmatched].map(joined_headings.__contains__)
+            text_list = texts.tolist()
+            is_biblio = words_matching(BIBLIO_RE, text_list) # References span several words, so match the page's word stream once
+            is_symbol = texts.map(POTENTIAL_SYMBOL_RE_OCR.match).notna()
+            element_types = np.select([is_heading, is_biblio, is_symbol], ["heading", "biblio_ref", "potential_symbol"], default="text_block")
+            left, top, width, height = (ocr_data[c].to_numpy(dtype=int) for c in ('left', 'top', 'width', 'height'))
+            pdf_rects = np.column_stack((left / self.zoom_x, top / self.zoom_y, (left + width) / self.zoom_x, (top + height) / self.zoom_y)).tolist()
+            active_entry_for_sigil = entries_data[-1] if entries_data else None
+            if active_entry_for_sigil:
+                for i in np.flatnonzero(element_types == "potential_symbol"):
+                    img_path = self._save_sigil_image(fitz_page, pymupdf.Rect(pdf_rects[i]), active_entry_for_sigil["heading"], fitz_page.number + 1)
+                    if img_path:
+                        sigil_meta = {"image_path": img_path, "parent_entry_heading": active_entry_for_sigil["heading"], "page_number": fitz_page.number + 1, "source_text": text_list[i], "bounding_box_pdf_coords": tuple(pdf_rects[i]), "extraction_method": "ocr"}
+                        active_entry_for_sigil["sigils_metadata"].append(sigil_meta); element_types[i] = "saved_sigil"
+            visual_elements = [{'rect': (x,y,w,h), 'type': t, 'text_snippet': text, 'width': w, 'height': h}
+                               for x, y, w, h, t, text in zip(left.tolist(), top.tolist(), width.tolist(), height.tolist(), element_types.tolist(), text_list)]
         except Exception as ocr_error: self.log_message(f"OCR error page {fitz_page.number+1}: {ocr_error}", "ERROR")
         return entries_data, visual_elements
 
-    def _extract_elements_from_plumber_page(self, plumber_page, fitz_page_for_saving):
-        entries_data, visual_elements, current_entry = [], [], None
-        chars = plumber_page.chars 
-        page_text_for_entry_parsing = plumber_page.extract_text(x_tolerance=2,y_tolerance=3)
-        if not page_text_for_entry_parsing: return [], []
-        lines_for_parsing = page_text_for_entry_parsing.split('\n')
-        for line_text_raw in lines_for_parsing:
-            line_text = line_text_raw.strip(); 
-            if not line_text: continue
-            line_bbox_plumber = None
-            for p_line in plumber_page.lines: 
-                if line_text in p_line['text']: line_bbox_plumber = (p_line['x0'],p_line['top'],p_line['x1'],p_line['bottom']); break
-            if line_bbox_plumber: visual_elements.append({'rect': line_bbox_plumber, 'type': 'text_block', 'text_snippet': line_text[:30]})
-            heading_match = HEADING_CLASS_RE.match(line_text)
-            if heading_match:
-                if current_entry: 
-                    current_entry["description"] = " ".join(current_entry["description_parts"]).strip(); del current_entry["description_parts"]
-                    temp_biblio_set=set(); 
-                    for bib_match in BIBLIO_RE.finditer(current_entry.get("description","")): temp_biblio_set.add(bib_match.group(0).strip())
-                    current_entry["references_raw"]=sorted(list(temp_biblio_set)); entries_data.append(current_entry)
-                heading, category = heading_match.group(1).strip(), heading_match.group(2).strip()
-                current_entry = {"heading": heading, "class": category, "sigils_metadata": [], "description_parts": [], "references_raw": set(), "page_number": plumber_page.page_number}
-                remaining = line_text[heading_match.end():].strip()
-                if remaining: current_entry["description_parts"].append(remaining)
-                if line_bbox_plumber: visual_elements.append({'rect': line_bbox_plumber, 'type': 'heading', 'text_snippet': heading})
-            elif current_entry: current_entry["description_parts"].append(line_text)
-        for char_info in chars:
-            char_text = char_info['text']
-            if (len(char_text)==1 and not char_text.isalnum() and char_text not in COMMON_PUNCTUATION and not char_text.isspace()):
-                if current_entry:
-                    sigil_bbox_pdf_points_rect = pymupdf.Rect(char_info['x0'],char_info['top'],char_info['x1'],char_info['bottom'])
-                    padding = 1; padded_bbox = pymupdf.Rect(sigil_bbox_pdf_points_rect.x0-padding, sigil_bbox_pdf_points_rect.y0-padding, sigil_bbox_pdf_points_rect.x1+padding, sigil_bbox_pdf_points_rect.y1+padding)
-                    if padded_bbox.x0<0 or padded_bbox.y0<0 or padded_bbox.x1>plumber_page.width or padded_bbox.y1>plumber_page.height or padded_bbox.width > plumber_page.width/2 or padded_bbox.height > 50: continue
-                    img_path = self._save_sigil_image(fitz_page_for_saving, padded_bbox, current_entry["heading"], plumber_page.page_number)
-                    element_type_for_visual = "potential_symbol"
-                    if img_path:
-                        sigil_meta = {"image_path": img_path, "parent_entry_heading": current_entry["heading"], "page_number": plumber_page.page_number, "source_text": char_text, "bounding_box_pdf_coords": (padded_bbox.x0,padded_bbox.y0,padded_bbox.x1,padded_bbox.y1), "extraction_method": "direct"}
-                        current_entry["sigils_metadata"].append(sigil_meta); element_type_for_visual = "saved_sigil"
-                    visual_elements.append({'rect': (char_info['x0'],char_info['top'],char_info['x1'],char_info['bottom']), 'type': element_type_for_visual, 'text_snippet': char_text})
-        for word in plumber_page.extract_words(x_tolerance=1,y_tolerance=1):
-            if BIBLIO_RE.search(word['text']): visual_elements.append({'rect': (word['x0'],word['top'],word['x1'],word['bottom']), 'type': 'biblio_ref', 'text_snippet': word['text']})
-        if current_entry: 
-            current_entry["description"] = " ".join(current_entry["description_parts"]).strip(); del current_entry["description_parts"]
-            temp_biblio_set=set(); 
-            for bib_match in BIBLIO_RE.finditer(current_entry.get("description","")): temp_biblio_set.add(bib_match.group(0).strip())
-            current_entry["references_raw"]=sorted(list(temp_biblio_set)); entries_data.append(current_entry)
-        unique_visual_elements=[]; seen_rects=set()
-        for ve in visual_elements:
-            rect_tuple=tuple(ve['rect']); 
-            if rect_tuple not in seen_rects: unique_visual_elements.append(ve); seen_rects.add(rect_tuple)
-        return entries_data, unique_visual_elements
-
     # --- Query Tab Methods ---
     def load_scanned_data_for_query(self):
         try:
-            with open(OUTPUT_JSON_PATH, 'r', encoding='utf-8') as f: self.scanned_data_for_query = json.load(f)
+            with open(OUTPUT_JSON_PATH, 'rb') as f: raw_json = f.read()
+            # orjson.JSONDecodeError subclasses json.JSONDecodeError, so one handler below covers both
+            self.scanned_data_for_query = orjson.loads(raw_json) if orjson else json.loads(raw_json)
+            self._build_sigil_hash_index()
+            self._build_query_index()
             self.log_message(f"Loaded {len(self.scanned_data_for_query)} entries from {OUTPUT_JSON_PATH} for querying.", "INFO")
             self.display_query_results(self.scanned_data_for_query)
         except FileNotFoundError: messagebox.showerror("Error", f"Data file not found: {OUTPUT_JSON_PATH}"); self.log_message(f"Error: {OUTPUT_JSON_PATH} not found.", "ERROR")
         except json.JSONDecodeError: messagebox.showerror("Error", f"Could not decode JSON from {OUTPUT_JSON_PATH}."); self.log_message(f"Error: Could not decode JSON from {OUTPUT_JSON_PATH}.", "ERROR")
         except Exception as e: messagebox.showerror("Error", f"Error loading data: {e}"); self.log_message(f"Error loading data: {e}", "ERROR")
 
+    def _build_sigil_hash_index(self):
+        """Packs the pHash of every sigil image into one uint64 array; sigils from older scans
+        without a stored 'phash_u64' are hashed from their image once here."""
+        hashes, hash_meta, cache_dirty = [], [], False
+        for entry in self.scanned_data_for_query:
+            for sigil_meta in entry.get("sigils_metadata", []):
+                img_path = sigil_meta.get("image_path")
+                if not img_path or not os.path.exists(img_path): continue
+                phash_u64 = sigil_meta.get("phash_u64")
+                if phash_u64 is None:
+                    mtime = os.path.getmtime(img_path); cached = self._phash_cache.get(img_path)
+                    if cached and cached[0] == mtime: phash_u64 = cached[1]
+                    else:
+                        try: phash_u64 = int(str(imagehash.phash(Image.open(img_path))), 16)
+                        except Exception as e: self.log_message(f"Error processing db image {img_path}: {e}", "WARNING"); continue
+                        self._phash_cache[img_path] = (mtime, phash_u64); cache_dirty = True
+                hashes.append(phash_u64); hash_meta.append((sigil_meta, entry))
+        self._hash_array = np.array(hashes, dtype=np.uint64); self._hash_meta = hash_meta
+        if cache_dirty: self._save_phash_cache()
+
+    @staticmethod
+    def _load_phash_cache():
+        try:
+            with open(PHASH_CACHE_PATH, "rb") as f: phash_cache = pickle.load(f)
+        except Exception: return {} # Missing, corrupt or outdated: it is only a cache, so start over
+        return phash_cache if isinstance(phash_cache, dict) else {}
+
+    def _save_phash_cache(self):
+        tmp_path = PHASH_CACHE_PATH + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f: pickle.dump(self._phash_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, PHASH_CACHE_PATH)
+        except OSError as e: self.log_message(f"Could not save pHash cache: {e}", "WARNING")
+
+    def _build_query_index(self):
+        """Indexes every entry's searchable fields by trigram. Any substring of 3+ chars implies all of its
+        trigrams, so intersecting their postings gives an exact candidate set for the substring search."""
+        self._query_blobs, self._trigram_index = [], {}
+        for entry_idx, entry in enumerate(self.scanned_data_for_query):
+            fields = [entry.get("heading",""), entry.get("class",""), entry.get("description","")]
+            fields += entry.get("references_raw",[]) + [m.get("source_text","") for m in entry.get("sigils_metadata",[])]
+            # \x00 never occurs in a search term, so no match can span two fields
+            blob = "\x00".join(fields).lower(); self._query_blobs.append(blob)
+            for trigram in {blob[i:i+3] for i in range(len(blob) - 2)}:
+                if "\x00" not in trigram: self._trigram_index.setdefault(trigram, set()).add(entry_idx)
+
+    def _on_query_change(self, event=None):
+        if self._pending_query_search: self.root.after_cancel(self._pending_query_search)
+        self._pending_query_search = self.root.after(150, self._run_debounced_query_search)
+
+    def _run_debounced_query_search(self):
+        self._pending_query_search = None
+        if self.scanned_data_for_query: self.perform_query_search()
+
     def perform_query_search(self):
         if not self.scanned_data_for_query: messagebox.showinfo("No Data", "Load scanned data first."); return
         search_term = self.query_search_var.get().lower().strip()
+        self._query_generation += 1
         if not search_term: self.display_query_results(self.scanned_data_for_query); return
-        filtered_data = []
-        for entry in self.scanned_data_for_query:
-            match = False
-            if search_term in entry.get("heading","").lower(): match=True
-            if not match and search_term in entry.get("class","").lower(): match=True
-            if not match and search_term in entry.get("description","").lower(): match=True
-            if not match and any(search_term in ref.lower() for ref in entry.get("references_raw",[])): match=True
-            if not match:
-                for sigil_meta in entry.get("sigils_metadata",[]):
-                    if search_term in sigil_meta.get("source_text","").lower(): match=True; break
-            if match: filtered_data.append(entry)
+        # Filter on the search worker with a snapshot of the indexes; only the newest search gets displayed
+        generation = self._query_generation
+        future = self._query_search_pool.submit(self._filter_query_results, search_term, self.scanned_data_for_query, self._query_blobs, self._trigram_index)
+        future.add_done_callback(lambda f: self.root.after(0, self._show_query_search_result, generation, search_term, f))
+
+    @staticmethod
+    def _filter_query_results(search_term, entries, query_blobs, trigram_index):
+        """Entries whose searchable text contains search_term, in their original order."""
+        candidates = range(len(query_blobs))
+        if len(search_term) >= 3:
+            postings = sorted((trigram_index.get(search_term[i:i+3], set()) for i in range(len(search_term) - 2)), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates: break
+                candidates &= posting
+            candidates = sorted(candidates)
+        return [entries[i] for i in candidates if search_term in query_blobs[i]]
+
+    def _show_query_search_result(self, generation, search_term, future):
+        if generation != self._query_generation: return # A newer search is already on its way
+        try: filtered_data = future.result()
+        except Exception as e: self.log_message(f"Query search error: {e}", "ERROR"); return
         self.display_query_results(filtered_data)
         self.log_message(f"Query for '{search_term}' found {len(filtered_data)} results.", "INFO")
 
     def display_query_results(self, data_to_display):
+        self._query_rows, self._query_rows_shown, self._query_link_paths = data_to_display, 0, []
         self.query_results_text.config(state=tk.NORMAL); self.query_results_text.delete(1.0, tk.END)
         if not data_to_display: self.query_results_text.insert(tk.END, "No entries to display."); self.query_results_text.config(state=tk.DISABLED); return
-        for i, entry in enumerate(data_to_display):
-            self.query_results_text.insert(tk.END, f"--- Entry {i+1} ---\n")
-            self.query_results_text.insert(tk.END, f"Heading: {entry.get('heading','N/A')}\nClass: {entry.get('class','N/A')}\nPage: {entry.get('page_number','N/A')}\n")
-            self.query_results_text.insert(tk.END, f"Description: {entry.get('description','N/A')[:500]}...\n")
+        self._render_query_batch()
+
+    def _render_query_batch(self):
+        """Appends the next QUERY_RESULTS_BATCH_SIZE results; a trailing "Load more" button renders the following batch."""
+        self.query_results_text.config(state=tk.NORMAL)
+        if self._query_rows_shown: self.query_results_text.delete("query_load_more", tk.END) # Drop the previous button
+        start = self._query_rows_shown; self._query_rows_shown = end = min(start + QUERY_RESULTS_BATCH_SIZE, len(self._query_rows))
+        # The whole batch goes to Tk in one insert: alternating (text, tags) pairs, with each "View" link
+        # tagged sigil_link plus sigil_link_<n>, where n indexes _query_link_paths
+        insert_args, plain_text = [], []
+        for i, entry in enumerate(self._query_rows[start:end], start):
+            plain_text.append(f"--- Entry {i+1} ---\nHeading: {entry.get('heading','N/A')}\nClass: {entry.get('class','N/A')}\nPage: {entry.get('page_number','N/A')}\n")
+            plain_text.append(f"Description: {entry.get('description','N/A')[:500]}...\n")
             references = entry.get("references_raw",[]); 
-            if references: self.query_results_text.insert(tk.END, f"References: {', '.join(references)}\n")
+            if references: plain_text.append(f"References: {', '.join(references)}\n")
             sigils_meta = entry.get("sigils_metadata",[])
             if sigils_meta:
-                self.query_results_text.insert(tk.END, "Associated Sigils:\n")
+                plain_text.append("Associated Sigils:\n")
                 for j, sigil in enumerate(sigils_meta):
-                    self.query_results_text.insert(tk.END, f"  Sigil {j+1}: Source: '{sigil.get('source_text','N/A')}', Path: {os.path.basename(sigil.get('image_path','N/A'))} ")
-                    view_button = ttk.Button(self.query_results_text, text="View", command=lambda p=sigil.get('image_path'): self.show_sigil_image_popup(p))
-                    self.query_results_text.window_create(tk.END, window=view_button); self.query_results_text.insert(tk.END, "\n")
-            self.query_results_text.insert(tk.END, "\n\n")
+                    plain_text.append(f"  Sigil {j+1}: Source: '{sigil.get('source_text','N/A')}', Path: {os.path.basename(sigil.get('image_path','N/A'))} ")
+                    insert_args += ["".join(plain_text), (), "[View]", ("sigil_link", f"sigil_link_{len(self._query_link_paths)}")]
+                    plain_text = ["\n"]; self._query_link_paths.append(sigil.get('image_path'))
+            plain_text.append("\n\n")
+        self.query_results_text.insert(tk.END, *insert_args, "".join(plain_text), ())
+        remaining = len(self._query_rows) - end
+        if remaining:
+            self.query_results_text.mark_set("query_load_more", "end-1c"); self.query_results_text.mark_gravity("query_load_more", tk.LEFT)
+            load_more_button = ttk.Button(self.query_results_text, text=f"Load more ({remaining} remaining)", command=self._render_query_batch)
+            self.query_results_text.window_create(tk.END, window=load_more_button)
         self.query_results_text.config(state=tk.DISABLED)
 
+    def _on_sigil_link_click(self, event):
+        for tag in self.query_results_text.tag_names(f"@{event.x},{event.y}"):
+            if tag.startswith("sigil_link_"): self.show_sigil_image_popup(self._query_link_paths[int(tag[len("sigil_link_"):])]); return
+
     def show_sigil_image_popup(self, image_path):
         if not image_path or not os.path.exists(image_path): messagebox.showerror("Error", f"Image not found: {image_path}"); return
         try:
@@ -629,8 +1085,8 @@ class PDFScannerApp:
             self.draw_canvas.create_line(self.draw_last_x, self.draw_last_y, event.x, event.y,
                                          width=DRAW_LINE_WIDTH, fill=DRAW_COLOR,
                                          capstyle=tk.ROUND, smooth=tk.TRUE, splinesteps=36)
-            self.pil_draw_context.line([(self.draw_last_x, self.draw_last_y), (event.x, event.y)],
-                                       fill=DRAW_COLOR, width=DRAW_LINE_WIDTH, joint="curve")
+            stamp_line(self._draw_arr, self.draw_last_x, self.draw_last_y, event.x, event.y, DRAW_LINE_WIDTH, DRAW_INK_LEVEL)
+            self._canvas_dirty = True
         self.draw_last_x, self.draw_last_y = event.x, event.y
 
     def reset_draw_canvas_pos(self, event):
@@ -638,7 +1094,7 @@ class PDFScannerApp:
 
     def clear_drawing_canvas(self):
         self.draw_canvas.delete("all")
-        self.pil_draw_context.rectangle([0, 0, DRAW_CANVAS_WIDTH, DRAW_CANVAS_HEIGHT], fill=DRAW_BG_COLOR)
+        self._draw_arr.fill(DRAW_BG_LEVEL); self._canvas_dirty = False # Reuse the hashing buffer, one memset
         self.sigil_search_status_label.config(text="Canvas cleared. Draw a new symbol.")
         for widget in self.sigil_search_results_content_frame.winfo_children(): widget.destroy()
         ttk.Label(self.sigil_search_results_content_frame, text="Draw a symbol and click 'Search Drawn Sigil'.").pack()
@@ -651,22 +1107,13 @@ class PDFScannerApp:
             self.load_scanned_data_for_query() 
             if not self.scanned_data_for_query:
                 messagebox.showerror("Error", "Scanned data (JSON) not loaded."); self.sigil_search_status_label.config(text="Error: Load scanned data first."); return
-        if self.drawn_image_pil.getcolors(1) and self.drawn_image_pil.getcolors(1)[0][1] == Image.Color.getrgb(DRAW_BG_COLOR) and \
-           self.drawn_image_pil.getcolors(1)[0][0] == DRAW_CANVAS_WIDTH * DRAW_CANVAS_HEIGHT:
+        if not self._canvas_dirty:
             messagebox.showinfo("Empty Canvas", "Please draw a symbol."); self.sigil_search_status_label.config(text="Draw a symbol first."); return
-        try: drawn_hash = imagehash.phash(self.drawn_image_pil)
+        try: drawn_hash = imagehash.phash(Image.fromarray(self._draw_arr, 'L'))
         except Exception as e: messagebox.showerror("Hashing Error", f"Could not process drawing: {e}"); self.sigil_search_status_label.config(text="Error processing drawing."); return
-        matches = []
-        for entry in self.scanned_data_for_query:
-            for sigil_meta in entry.get("sigils_metadata", []):
-                img_path = sigil_meta.get("image_path")
-                if img_path and os.path.exists(img_path):
-                    try:
-                        db_img = Image.open(img_path); db_hash = imagehash.phash(db_img)
-                        distance = drawn_hash - db_hash 
-                        matches.append({"distance": distance, "sigil_meta": sigil_meta, "parent_entry": entry })
-                    except Exception as e: self.log_message(f"Error processing db image {img_path}: {e}", "WARNING")
-        matches.sort(key=lambda x: x["distance"]); top_matches = matches[:10] 
+        distances = hamming_distances(self._hash_array, int(str(drawn_hash), 16))
+        top_matches = [{"distance": int(distances[i]), "sigil_meta": self._hash_meta[i][0], "parent_entry": self._hash_meta[i][1]}
+                       for i in nearest_indices(distances, 10)]
         for widget in self.sigil_search_results_content_frame.winfo_children(): widget.destroy() 
         if not top_matches: ttk.Label(self.sigil_search_results_content_frame, text="No matches found.").pack(); self.sigil_search_status_label.config(text="Search complete. No matches found."); return
         self.sigil_search_status_label.config(text=f"Search complete. Displaying top {len(top_matches)} matches.")
@@ -680,8 +1127,11 @@ class PDFScannerApp:
             img_display_frame.pack(fill=tk.X)
 
             try:
-                img = Image.open(sig_meta['image_path']); img.thumbnail((60, 60), Image.LANCZOS) 
-                photo = ImageTk.PhotoImage(img)
+                thumb_path = sig_meta.get('thumb_path')
+                if thumb_path and os.path.exists(thumb_path): photo = tk.PhotoImage(file=thumb_path, master=self.root) # Pre-rendered at scan time
+                else: # Sigils from scans that predate thumbnails
+                    img = Image.open(sig_meta['image_path']); img.thumbnail((60, 60), Image.BILINEAR)
+                    photo = ImageTk.PhotoImage(img, master=self.root)
                 img_label = ttk.Label(img_display_frame, image=photo); img_label.image = photo
                 img_label.pack(side=tk.LEFT, padx=5, pady=2)
             except Exception as e: ttk.Label(img_display_frame, text=f"[No Preview]").pack(side=tk.LEFT, padx=5)
@@ -701,11 +1151,33 @@ class PDFScannerApp:
     def prepare_sigil_for_llm_analysis(self, sigil_meta, parent_entry_data):
         self.active_sigil_for_llm_meta = {**sigil_meta, "parent_entry_description": parent_entry_data.get("description", "")} # Add description
         self.active_sigil_for_llm_image_path = sigil_meta.get("image_path")
+        self._active_sigil_bytes = self._active_sigil_b64 = self._active_sigil_mime = None
+        if self.active_sigil_for_llm_image_path and os.path.exists(self.active_sigil_for_llm_image_path):
+            try:
+                img_path = self.active_sigil_for_llm_image_path; mtime = os.path.getmtime(img_path)
+                cached = self._sigil_payload_cache.get(img_path)
+                if not cached or cached[0] != mtime:
+                    with open(img_path, "rb", buffering=1 << 16) as img_file: img_bytes = img_file.read()
+                    cached = self._sigil_payload_cache[img_path] = (mtime, img_bytes, base64.b64encode(img_bytes).decode('ascii'))
+                _, self._active_sigil_bytes, self._active_sigil_b64 = cached; self._active_sigil_mime = "image/png"
+            except OSError as e: self.log_message(f"Error reading active sigil image: {e}", "WARNING")
+
+        meta = self.active_sigil_for_llm_meta
+        self._llm_context_prefix = (
+            f"The user is asking about the following sigil:\n"
+            f"- Image: [Attached Below]\n"
+            f"- Identified Source Text (from PDF): '{meta.get('source_text', 'N/A')}'\n"
+            f"- Parent Dictionary Entry Heading: '{meta.get('parent_entry_heading', 'N/A')}'\n"
+            f"- Found on Page: {meta.get('page_number', 'N/A')}\n"
+            f"- Extraction Method: {meta.get('extraction_method', 'N/A')}\n"
+            f"- Parent Entry Description (partial): '{meta.get('parent_entry_description', '')[:200]}...'\n\n"
+        )
+        self._llm_history = [] # A new sigil starts a new conversation
 
         self.active_sigil_llm_label.config(text=f"Active: {sigil_meta.get('source_text', 'N/A')} from '{sigil_meta.get('parent_entry_heading', 'N/A')}'")
-        if self.active_sigil_for_llm_image_path and os.path.exists(self.active_sigil_for_llm_image_path):
+        if self._active_sigil_bytes:
             try:
-                img = Image.open(self.active_sigil_for_llm_image_path)
+                img = Image.open(io.BytesIO(self._active_sigil_bytes))
                 img.thumbnail((100, 100), Image.LANCZOS)
                 photo = ImageTk.PhotoImage(img)
                 self.active_sigil_llm_image_label.config(image=photo)
@@ -726,9 +1198,7 @@ class PDFScannerApp:
         api_key = self.gemini_api_key.get()
         if not api_key: return "Gemini API Key not set."
         try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash-latest') 
-            await model.generate_content_async("test") 
+            await self._get_gemini_model(api_key).generate_content_async("test") 
             return "Gemini connection successful!"
         except Exception as e:
             return f"Gemini connection failed: {str(e)[:100]}..."
@@ -738,22 +1208,36 @@ class PDFScannerApp:
         api_key = self.openai_api_key.get()
         if not api_key: return "OpenAI API Key not set."
         try:
-            client = openai.AsyncOpenAI(api_key=api_key)
+            client = await self._get_openai_client(api_key)
             await client.models.list() 
             return "OpenAI connection successful!"
         except Exception as e:
             return f"OpenAI connection failed: {str(e)[:100]}..."
 
+    def _get_gemini_model(self, api_key):
+        """Cached Gemini model; rebuilt only when the API key changes."""
+        if self._gemini_model is None or self._gemini_model[0] != api_key:
+            genai.configure(api_key=api_key)
+            self._gemini_model = (api_key, genai.GenerativeModel(LLM_MODEL_NAMES["Gemini"]))
+        return self._gemini_model[1]
+
+    async def _get_openai_client(self, api_key):
+        """Cached OpenAI client; a key change closes the old client's connection pool and builds a new one."""
+        if self._openai_client is None or self._openai_client[0] != api_key:
+            if self._openai_client is not None: await self._openai_client[1].close()
+            self._openai_client = (api_key, openai.AsyncOpenAI(api_key=api_key))
+        return self._openai_client[1]
+
     def _run_async_task_in_thread(self, coro):
-        """Helper to run an asyncio coroutine in a new thread."""
-        def thread_target():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(coro)
-            finally:
-                loop.close()
-        threading.Thread(target=thread_target, daemon=True).start()
+        """Helper to schedule an asyncio coroutine on the background LLM loop."""
+        return asyncio.run_coroutine_threadsafe(coro, self._llm_loop)
+
+    def on_close(self):
+        """Stops the background LLM loop and the sigil writer pool, then closes the window."""
+        self._llm_loop.call_soon_threadsafe(self._llm_loop.stop)
+        if self._page_pool is not None: self._page_pool.shutdown(wait=False, cancel_futures=True) # Queued pages never start
+        self._sigil_render_pool.shutdown(wait=False); self._query_search_pool.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
 
     def test_api_connection(self, provider):
         self.llm_connection_status_label.config(text=f"Testing {provider}...")
@@ -775,33 +1259,81 @@ class PDFScannerApp:
         self.llm_chat_history.see(tk.END)
         self.llm_chat_history.config(state=tk.DISABLED)
 
+    def _llm_cache_path(self, provider, prompt_parts_or_messages, image_bytes=None):
+        key = hashlib.sha256()
+        key.update(provider.encode()); key.update(LLM_MODEL_NAMES.get(provider, "").encode())
+        key.update(json.dumps(prompt_parts_or_messages, sort_keys=True, default=lambda o: hashlib.sha256(o).hexdigest() if isinstance(o, bytes) else str(o)).encode())
+        key.update(image_bytes or b'')
+        return os.path.join(LLM_CACHE_DIR, f"{key.hexdigest()}.json")
+
     async def _call_llm_api_async(self, provider, prompt_parts_or_messages, image_bytes=None):
+        """Serves repeated prompts from the disk cache; otherwise bounds in-flight requests
+        and paces them to LLM_REQUESTS_PER_MINUTE before calling the provider.
+        Returns (response text, is_answer); is_answer is False for error and no-response messages."""
+        cache_path = self._llm_cache_path(provider, prompt_parts_or_messages, image_bytes)
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f: return json.load(f)["response"], True
+            except (OSError, ValueError, KeyError): pass # Unreadable entry, fall through and refresh it
+        if self._llm_semaphore is None: self._llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENT_REQUESTS)
+        async with self._llm_semaphore:
+            await self._llm_rate_limiter.acquire()
+            response_text, cacheable = await self._request_llm_async(provider, prompt_parts_or_messages)
+        if cacheable:
+            tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f: json.dump({"provider": provider, "model": LLM_MODEL_NAMES.get(provider), "response": response_text}, f, ensure_ascii=False)
+                os.replace(tmp_path, cache_path)
+            except OSError as e: self.root.after(0, self.log_message, f"Could not write LLM cache entry: {e}", "WARNING")
+        return response_text, cacheable
+
+    async def _request_llm_async(self, provider, prompt_parts_or_messages):
+        """Returns (response text, cacheable); only real model answers are cacheable."""
         if provider == "Gemini":
-            if not genai: return "Error: Gemini library not installed."
+            if not genai: return "Error: Gemini library not installed.", False
             api_key = self.gemini_api_key.get()
-            if not api_key: return "Error: Gemini API key not set."
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash-latest') 
-            response = await model.generate_content_async(prompt_parts_or_messages)
+            if not api_key: return "Error: Gemini API key not set.", False
+            response = await self._get_gemini_model(api_key).generate_content_async(prompt_parts_or_messages)
             if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                return response.candidates[0].content.parts[0].text
-            else: return f"Gemini: No valid response. {response.text if hasattr(response, 'text') else ''}"
+                return response.candidates[0].content.parts[0].text, True
+            else: return f"Gemini: No valid response. {response.text if hasattr(response, 'text') else ''}", False
 
         elif provider == "OpenAI":
-            if not openai: return "Error: OpenAI library not installed."
+            if not openai: return "Error: OpenAI library not installed.", False
             api_key = self.openai_api_key.get()
-            if not api_key: return "Error: OpenAI API key not set."
-            client = openai.AsyncOpenAI(api_key=api_key)
+            if not api_key: return "Error: OpenAI API key not set.", False
+            client = await self._get_openai_client(api_key)
             response = await client.chat.completions.create(
-                model="gpt-4o", 
+                model=LLM_MODEL_NAMES["OpenAI"], 
                 messages=prompt_parts_or_messages,
                 max_tokens=1000
             )
             if response.choices and response.choices[0].message and response.choices[0].message.content:
-                return response.choices[0].message.content
-            else: return "OpenAI: No valid response."
-        return "Error: Unknown LLM provider."
-
+                return response.choices[0].message.content, True
+            else: return "OpenAI: No valid response.", False
+        return "Error: Unknown LLM provider.", False
+
+
+    def _build_llm_prompt(self, provider, turns, user_message, image_bytes, image_b64, image_mime):
+        """Provider-specific prompt: the cached sigil context and the image open the conversation with its oldest
+        kept question, followed by the kept answers and questions. Without earlier turns this is one user message."""
+        questions = [question for question, _ in turns] + [user_message]
+        context_text = (
+            self._llm_context_prefix +
+            f"User's question about this sigil: {questions[0]}\n\n"
+            f"Please provide an analysis based on this information and the image. "
+            f"Consider its visual characteristics, potential meanings, and any connections to the provided context from the dictionary."
+        )
+        if provider == "Gemini":
+            if not turns: return [context_text, {"mime_type": image_mime, "data": image_bytes}]
+            contents = [{"role": "user", "parts": [context_text, {"mime_type": image_mime, "data": image_bytes}]}]
+            for (_, answer), question in zip(turns, questions[1:]): contents += [{"role": "model", "parts": [answer]}, {"role": "user", "parts": [question]}]
+            return contents
+        if provider == "OpenAI":
+            messages = [{"role": "user", "content": [ {"type": "text", "text": context_text}, {"type": "image_url", "image_url": {"url": f"data:{image_mime};base64,{image_b64}"}}]}]
+            for (_, answer), question in zip(turns, questions[1:]): messages += [{"role": "assistant", "content": answer}, {"role": "user", "content": question}]
+            return messages
+        return None
 
     def send_to_llm_chat_action(self):
         user_message = self.llm_user_input_var.get().strip()
@@ -820,34 +1352,16 @@ class PDFScannerApp:
         async def process_and_respond():
             try:
                 provider = self.selected_llm_provider_var.get()
-                image_b64 = None
-                if self.active_sigil_for_llm_image_path and os.path.exists(self.active_sigil_for_llm_image_path):
-                    with open(self.active_sigil_for_llm_image_path, "rb") as img_file:
-                        image_b64 = base64.b64encode(img_file.read()).decode('utf-8')
+                image_bytes, image_b64, image_mime = self._active_sigil_bytes, self._active_sigil_b64, self._active_sigil_mime
                 if not image_b64:
                     self.root.after(0, lambda: self.append_to_llm_chat("System", "Error: Could not load active sigil image."))
                     return
 
-                context_text = (
-                    f"The user is asking about the following sigil:\n"
-                    f"- Image: [Attached Below]\n"
-                    f"- Identified Source Text (from PDF): '{self.active_sigil_for_llm_meta.get('source_text', 'N/A')}'\n"
-                    f"- Parent Dictionary Entry Heading: '{self.active_sigil_for_llm_meta.get('parent_entry_heading', 'N/A')}'\n"
-                    f"- Found on Page: {self.active_sigil_for_llm_meta.get('page_number', 'N/A')}\n"
-                    f"- Extraction Method: {self.active_sigil_for_llm_meta.get('extraction_method', 'N/A')}\n"
-                    f"- Parent Entry Description (partial): '{self.active_sigil_for_llm_meta.get('parent_entry_description', '')[:200]}...'\n\n"
-                    f"User's question about this sigil: {user_message}\n\n"
-                    f"Please provide an analysis based on this information and the image. "
-                    f"Consider its visual characteristics, potential meanings, and any connections to the provided context from the dictionary."
-                )
-                prompt_data = None
-                if provider == "Gemini":
-                    prompt_data = [context_text, {"mime_type": "image/png", "data": image_b64}]
-                elif provider == "OpenAI":
-                    prompt_data = [{"role": "user", "content": [ {"type": "text", "text": context_text}, {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}}]}]
-                
+                history = self._llm_history # Bound now, so a reply landing after a new sigil is selected stays with its own sigil
+                prompt_data = self._build_llm_prompt(provider, history, user_message, image_bytes, image_b64, image_mime)
                 if prompt_data:
-                    llm_response = await self._call_llm_api_async(provider, prompt_data)
+                    llm_response, is_answer = await self._call_llm_api_async(provider, prompt_data)
+                    if is_answer: history.append((user_message, llm_response)); del history[:-LLM_HISTORY_MAX_TURNS] # Errors never become model turns
                     self.root.after(0, lambda: self.append_to_llm_chat("LLM", llm_response))
                 else:
                     self.root.after(0, lambda: self.append_to_llm_chat("System", "Error: Could not prepare prompt."))